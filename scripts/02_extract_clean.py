@@ -16,70 +16,218 @@ Tasks:
 """
 
 import argparse
+import enum
+import hashlib
+import json
 import os
 import pathlib
+import re
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import fitz  # PyMuPDF
 import pandas as pd
-# Import your chosen PDF extraction library, e.g.:
-# import fitz  # PyMuPDF
+import yaml
 
-def extract_text_from_pdf(pdf_path):
-    """Extracts text from a single PDF file."""
+# Cleaning patterns are compiled once at import rather than per PDF
+# Lines consisting only of a page number, e.g. "12" or "Page 12"
+_HEADER_FOOTER_RE = re.compile(r'^\s*(Page\s+)?\d+\s*$', re.MULTILINE | re.IGNORECASE)
+# Runs of spaces/tabs inside a line
+_WS_RE = re.compile(r'[ \t]+')
+# Smart quotes and dashes -> ASCII, applied in a single str.translate pass
+_SMART = str.maketrans({
+    '\u2018': "'", '\u2019': "'",
+    '\u201c': '"', '\u201d': '"',
+    '\u2013': '-', '\u2014': '-',
+})
+# Use the libyaml-backed dumper when PyYAML was built with it
+_YAML_DUMPER = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+def extract_text_from_pdf(pdf_path, output_path, front_matter=""):
+    """Extracts, cleans and writes the text of a PDF page by page.
+
+    Pages are streamed through a buffered writer so peak memory stays at
+    roughly one page instead of the whole document. The text goes to a
+    temporary file that replaces output_path only once extraction succeeds.
+    Returns the number of characters written, or None on error.
+    """
     print(f"  Extracting text from: {pdf_path.name}")
-    # Placeholder - Replace with actual extraction logic
+    tmp_path = output_path.with_name(output_path.name + ".part")
     try:
-        # Example using PyMuPDF (uncomment import fitz)
-        # doc = fitz.open(pdf_path)
-        # text = ""
-        # for page in doc:
-        #     text += page.get_text()
-        # doc.close()
-        # return text
-        with open(pdf_path, 'r', errors='ignore') as f: # Incorrect for PDF, just a placeholder!
-             return f.read()
-        print(f"    (Placeholder: Read {len(text)} chars)")
-        return "Placeholder text for " + pdf_path.name
+        with fitz.open(pdf_path) as doc, \
+             tmp_path.open('w', encoding='utf-8', buffering=1 << 20) as fh:
+            written = fh.write(front_matter)
+            page_count = 0
+            for page in doc:
+                page_text = clean_page(page.get_text("text"))
+                if not page_text:
+                    continue
+                if page_count:
+                    written += fh.write("\n")
+                written += fh.write(page_text)
+                page_count += 1
+        os.replace(tmp_path, output_path)
+        print(f"    Wrote {written} chars from {page_count} pages")
+        return written
     except Exception as e:
         print(f"    Error extracting text from {pdf_path.name}: {e}")
+        tmp_path.unlink(missing_ok=True)
         return None
 
-def clean_text(raw_text, filename):
-    """Applies cleaning rules to the extracted text."""
-    print(f"  Cleaning text for: {filename}")
-    # TODO: Implement cleaning logic
-    # - Regex for headers/footers (often page numbers at bottom/top)
-    # - Unicode normalization (unicodedata library)
-    # - Whitespace cleanup (strip lines, replace multiple spaces)
-    # - Smart quote/dash replacement
-    text = raw_text
-    # Example: Basic whitespace strip
+def clean_page(raw_text):
+    """Applies cleaning rules to the text of a single page."""
+    text = unicodedata.normalize('NFKC', raw_text)
+    text = text.translate(_SMART)
+    text = _HEADER_FOOTER_RE.sub('', text)
+    text = _WS_RE.sub(' ', text)
+    # Strip lines and drop the blanks left behind by header/footer removal
     lines = [line.strip() for line in text.splitlines()]
-    text = "\n".join(filter(None, lines))
-    print(f"    (Placeholder: Cleaned {len(text)} chars)")
-    return text
+    return "\n".join(filter(None, lines))
 
 def inject_metadata(cleaned_text, metadata):
     """Prepends YAML front-matter to the text."""
-    front_matter = "---
-"
-    for key, value in metadata.items():
-        # Basic YAML formatting (handle potential quotes later if needed)
-        front_matter += f"{key}: {value}\n"
-    front_matter += "---
-"
-    return front_matter + cleaned_text
+    if not metadata:
+        # yaml.dump({}) would emit a "{}" body; leave the text without front-matter
+        return cleaned_text
+    # numpy scalars from pandas (e.g. Int16 seasons) are not YAML-serializable
+    metadata = {k: v.item() if hasattr(v, 'item') else v for k, v in metadata.items()}
+    front_matter = yaml.dump(metadata, Dumper=_YAML_DUMPER, sort_keys=False,
+                             allow_unicode=True, default_flow_style=False)
+    return f"---\n{front_matter}---\n{cleaned_text}"
+
+class RowStatus(enum.Enum):
+    """Outcome of processing a single manifest row."""
+    PROCESSED = "processed"
+    SKIPPED = "skipped"
+    ERROR = "error"
+
+# Manifest columns used by this script; anything else in the CSV is ignored.
+# Fixed dtypes skip type inference; nullable Int16 keeps missing seasons as <NA>.
+MANIFEST_DTYPES = {
+    'season': 'Int16',
+    'episode': 'Int16',
+    'title': 'string',
+    'file_name': 'string',
+    'checksum': 'string',
+}
+
+# Per-output record of the source PDF each text file was built from
+CACHE_FILENAME = '.cache.json'
+
+def load_cache(output_dir):
+    """Loads the output_filename -> {src_checksum, mtime} cache, if any."""
+    cache_path = output_dir / CACHE_FILENAME
+    try:
+        return json.loads(cache_path.read_text(encoding='utf-8'))
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"Warning: Ignoring unreadable cache file {cache_path}: {e}")
+        return {}
+
+def save_cache(output_dir, cache):
+    """Writes the processing cache back to the output directory."""
+    cache_path = output_dir / CACHE_FILENAME
+    cache_path.write_text(json.dumps(cache, indent=2, sort_keys=True), encoding='utf-8')
+
+def calculate_checksum(file_path, hash_algo='sha256'):
+    """Calculates the checksum of a file."""
+    hasher = hashlib.new(hash_algo)
+    with open(file_path, 'rb') as file:
+        while chunk := file.read(1 << 20):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def source_checksum(row_dict, pdf_path, cache_entry):
+    """Returns (checksum, mtime) identifying the current source PDF.
+
+    Prefers the manifest's checksum column, in which case the PDF is not
+    touched at all and mtime is None. Otherwise hashes the PDF, reusing the
+    cached hash when the file's mtime is unchanged.
+    """
+    checksum = row_dict.get('checksum')
+    if checksum is not None and pd.notna(checksum) and checksum:
+        return str(checksum), None
+    mtime = pdf_path.stat().st_mtime
+    if cache_entry and cache_entry.get('mtime') == mtime:
+        return cache_entry.get('src_checksum'), mtime
+    return calculate_checksum(pdf_path), mtime
+
+def output_filename_for(row_dict):
+    """Constructs expected output filename (e.g., S01E01.txt)."""
+    # Use info from manifest if available, otherwise fallback
+    s = row_dict.get('season')
+    e = row_dict.get('episode')
+    if s is not None and e is not None and not pd.isna(s) and not pd.isna(e):
+         return f"S{int(s):02d}E{int(e):02d}.txt"
+    # Fallback using the original PDF name (minus extension)
+    return pathlib.Path(row_dict['file_name']).stem + ".txt"
+
+def _process_row(row_dict, cache_entry, pdf_dir, output_dir, skip_existing, add_metadata):
+    """Extracts, cleans and writes the text for one manifest row.
+
+    Kept at module level so it can be pickled and run in worker processes.
+    The caller has already checked that the PDF exists in pdf_dir, and
+    passes cache_entry=None when the output file is absent.
+    Returns (RowStatus, cache entry for the output file or None).
+    """
+    pdf_filename = row_dict['file_name']
+    output_filename = output_filename_for(row_dict)
+
+    output_path = output_dir / output_filename
+    pdf_path = pdf_dir / pdf_filename # Assume PDFs are directly in pdf_dir for now
+
+    print(f"Processing manifest entry: {pdf_filename} -> {output_filename}")
+
+    try:
+        src_checksum, mtime = source_checksum(row_dict, pdf_path, cache_entry)
+    except Exception as e:
+        print(f"  Error reading source PDF {pdf_path.name}: {e}")
+        return RowStatus.ERROR, None
+
+    if (skip_existing and cache_entry
+            and cache_entry.get('src_checksum') == src_checksum):
+        print(f"  Skipping, output is up to date with source: {output_path.name}")
+        return RowStatus.SKIPPED, {'src_checksum': src_checksum, 'mtime': mtime}
+
+    front_matter = ""
+    if add_metadata:
+         metadata = dict(row_dict)
+         # Remove checksum or other irrelevant fields for front-matter
+         metadata.pop('checksum', None)
+         metadata.pop('file_name', None) # Maybe keep original filename?
+         metadata = {k:v for k, v in metadata.items() if pd.notna(v)} # Remove NaN
+         front_matter = inject_metadata("", metadata)
+
+    if extract_text_from_pdf(pdf_path, output_path, front_matter) is None:
+        return RowStatus.ERROR, None
+
+    print(f"  Successfully wrote: {output_path.name}")
+    return RowStatus.PROCESSED, {'src_checksum': src_checksum, 'mtime': mtime}
+
+def positive_int(value):
+    """argparse type for options that must be at least 1."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
 
 def main():
     parser = argparse.ArgumentParser(description='Extract and clean text from Wild Kratts PDF scripts.')
     parser.add_argument('--manifest', type=pathlib.Path, default='data/manifest.csv', help='Path to the input manifest CSV file.')
     parser.add_argument('--pdf_dir', type=pathlib.Path, required=True, help='Directory where the original PDF files are located (based on manifest).')
     parser.add_argument('--output_dir', type=pathlib.Path, default='data/extracted_text', help='Directory to save cleaned TXT files.')
-    parser.add_argument('--skip_existing', action='store_true', help='Do not re-process if output file already exists.')
+    parser.add_argument('--skip_existing', action='store_true', help='Do not re-process if the output file exists and its source PDF checksum is unchanged.')
     parser.add_argument('--add_metadata', action='store_true', help='Inject YAML front-matter metadata into output files.')
+    parser.add_argument('--workers', type=positive_int, default=os.cpu_count(), help='Number of worker processes used for extraction (default: CPU count).')
 
     args = parser.parse_args()
 
     try:
-        manifest_df = pd.read_csv(args.manifest)
+        manifest_df = pd.read_csv(args.manifest,
+                                  usecols=lambda col: col in MANIFEST_DTYPES,
+                                  dtype=MANIFEST_DTYPES,
+                                  engine='c')
     except FileNotFoundError:
         print(f"Error: Manifest file not found: {args.manifest}")
         return
@@ -89,65 +237,64 @@ def main():
 
     args.output_dir.mkdir(parents=True, exist_ok=True)
     print(f"Output directory: {args.output_dir}")
+    cache = load_cache(args.output_dir)
 
-    processed_count = 0
-    skipped_count = 0
-    error_count = 0
+    # One directory listing each up front instead of a stat() per manifest row
+    try:
+        present_pdfs = {entry.name for entry in os.scandir(args.pdf_dir) if entry.is_file()}
+    except OSError as e:
+        print(f"Error reading PDF directory {args.pdf_dir}: {e}")
+        return
+    existing_outputs = {entry.name for entry in os.scandir(args.output_dir) if entry.is_file()}
 
-    for index, row in manifest_df.iterrows():
-        pdf_filename = row.get('file_name') # Use 'file_name' column
-        if not pdf_filename or pd.isna(pdf_filename):
+    rows = []
+    missing_count = 0
+    # itertuples avoids building a pandas Series for every manifest row
+    for index, row in enumerate(manifest_df.itertuples(index=False, name='ManifestRow')):
+        pdf_filename = getattr(row, 'file_name', None) # Use 'file_name' column
+        if pdf_filename is None or pd.isna(pdf_filename) or not pdf_filename:
             print(f"Warning: Skipping row {index+2} due to missing file_name in manifest.")
             continue
-
-        # Construct expected output filename (e.g., S01E01.txt)
-        # Use info from manifest if available, otherwise fallback
-        s = row.get('season')
-        e = row.get('episode')
-        if s is not None and e is not None and not pd.isna(s) and not pd.isna(e):
-             output_filename = f"S{int(s):02d}E{int(e):02d}.txt"
-        else:
-             # Fallback using the original PDF name (minus extension)
-             output_filename = pathlib.Path(pdf_filename).stem + ".txt"
-
-        output_path = args.output_dir / output_filename
-        pdf_path = args.pdf_dir / pdf_filename # Assume PDFs are directly in pdf_dir for now
-
-        print(f"Processing manifest entry: {pdf_filename} -> {output_filename}")
-
-        if args.skip_existing and output_path.exists():
-            print(f"  Skipping, output file already exists: {output_path.name}")
-            skipped_count += 1
+        if pdf_filename not in present_pdfs:
+            print(f"Error: PDF file not found at expected path: {args.pdf_dir / pdf_filename}")
+            missing_count += 1
             continue
+        rows.append(row._asdict())
 
-        if not pdf_path.exists():
-            print(f"  Error: PDF file not found at expected path: {pdf_path}")
-            error_count += 1
-            continue
+    # Extraction is CPU-bound and independent per PDF, so fan out across processes
+    worker = partial(_process_row,
+                     pdf_dir=args.pdf_dir,
+                     output_dir=args.output_dir,
+                     skip_existing=args.skip_existing,
+                     add_metadata=args.add_metadata)
+    # Rows sharing an output name would race on the same file in parallel;
+    # keep only the last one, as the old sequential loop effectively did
+    rows_by_output = {}
+    duplicate_count = 0
+    for row_dict in rows:
+        name = output_filename_for(row_dict)
+        if name in rows_by_output:
+            print(f"Warning: {rows_by_output[name]['file_name']} and {row_dict['file_name']} both map to {name}; keeping the later entry.")
+            duplicate_count += 1
+        rows_by_output[name] = row_dict
+    output_filenames = list(rows_by_output)
+    rows = list(rows_by_output.values())
+    # A cache entry only counts if its output file is still on disk
+    cache_entries = [cache.get(name) if name in existing_outputs else None
+                     for name in output_filenames]
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        results = list(executor.map(worker, rows, cache_entries, chunksize=4))
 
-        raw_text = extract_text_from_pdf(pdf_path)
-        if raw_text is None:
-            error_count += 1
-            continue
+    # Record the source checksum of every up-to-date output for the next run
+    for name, (_, entry) in zip(output_filenames, results):
+        if entry is not None:
+            cache[name] = entry
+    save_cache(args.output_dir, cache)
 
-        cleaned_text = clean_text(raw_text, pdf_filename)
-
-        final_text = cleaned_text
-        if args.add_metadata:
-             metadata = row.to_dict()
-             # Remove checksum or other irrelevant fields for front-matter
-             metadata.pop('checksum', None)
-             metadata.pop('file_name', None) # Maybe keep original filename?
-             metadata = {k:v for k, v in metadata.items() if pd.notna(v)} # Remove NaN
-             final_text = inject_metadata(cleaned_text, metadata)
-
-        try:
-            output_path.write_text(final_text, encoding='utf-8')
-            print(f"  Successfully wrote: {output_path.name}")
-            processed_count += 1
-        except Exception as e:
-            print(f"  Error writing output file {output_path.name}: {e}")
-            error_count += 1
+    statuses = [status for status, _ in results]
+    processed_count = statuses.count(RowStatus.PROCESSED)
+    skipped_count = statuses.count(RowStatus.SKIPPED) + duplicate_count
+    error_count = statuses.count(RowStatus.ERROR) + missing_count
 
     print("\nExtraction complete.")
     print(f"  Processed: {processed_count}")